@@ -3,8 +3,11 @@
 
 import sys
 import traceback
+import atexit
 import logging
-from datetime import datetime
+import queue
+from logging.handlers import QueueHandler, QueueListener
+from datetime import datetime, timezone
 from http import HTTPStatus
 
 from aiohttp import web
@@ -12,8 +15,10 @@ from aiohttp.web import Request, Response, json_response
 from botbuilder.core import (
     ConversationState,
     MemoryStorage,
+    Storage,
     TurnContext,
     UserState,
+    serializer_helper,
 )
 from botbuilder.core.teams import (
     TeamsSSOTokenExchangeMiddleware
@@ -27,9 +32,11 @@ from bots import AuthBot
 # Create the loop and Flask app
 from config import DefaultConfig
 from dialogs import MainDialog
+import json_helper
 
 # Import and enable HTTP logging
 from simple_http_logger import enable_http_logging
+from http_logger import close_shared_session
 
 CONFIG = DefaultConfig()
 
@@ -37,6 +44,16 @@ CONFIG = DefaultConfig()
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
+# Hand log records to a queue and let a background thread write them, so the
+# event loop never blocks on console I/O. The handlers installed by basicConfig
+# are moved onto the listener to keep their formatting.
+LOG_QUEUE = queue.SimpleQueue()
+_root_logger = logging.getLogger()
+LOG_LISTENER = QueueListener(LOG_QUEUE, *_root_logger.handlers, respect_handler_level=True)
+_root_logger.handlers = [QueueHandler(LOG_QUEUE)]
+LOG_LISTENER.start()
+atexit.register(LOG_LISTENER.stop)
+
 # Enable HTTP request/response logging for all outgoing HTTP calls
 enable_http_logging()
 
@@ -44,6 +61,12 @@ enable_http_logging()
 # See https://aka.ms/about-bot-adapter to learn more about how bots work.
 ADAPTER = CloudAdapter(ConfigurationBotFrameworkAuthentication(CONFIG))
 
+# Activity type strings as they appear on incoming activities.
+_INVOKE = ActivityTypes.invoke.value
+_TRACE = ActivityTypes.trace.value
+_UTC = timezone.utc
+
+
 # Catch-all for errors.
 async def on_error(context: TurnContext, error: Exception):
     # This check writes out errors to console log .vs. app insights.
@@ -58,7 +81,7 @@ async def on_error(context: TurnContext, error: Exception):
     
     # Don't send error messages for invoke activities to prevent serialization issues
     # This addresses the issue mentioned in GitHub issue #2510
-    if context.activity.type == ActivityTypes.invoke:
+    if context.activity.type == _INVOKE:
         logger.warning("Error occurred during invoke activity - not sending user-facing error message")
         return
     
@@ -74,8 +97,8 @@ async def on_error(context: TurnContext, error: Exception):
         trace_activity = Activity(
             label="TurnError",
             name="on_turn_error Trace",
-            timestamp=datetime.utcnow(),
-            type=ActivityTypes.trace,
+            timestamp=datetime.now(_UTC),
+            type=_TRACE,
             value=f"{error}",
             value_type="https://www.botframework.com/schemas/error",
         )
@@ -85,8 +108,30 @@ async def on_error(context: TurnContext, error: Exception):
 
 ADAPTER.on_turn_error = on_error
 
-# Create MemoryStorage and state
-MEMORY = MemoryStorage()
+def create_storage(config: DefaultConfig) -> Storage:
+    """Create the storage shared by bot state and SSO token exchange deduplication.
+
+    MemoryStorage lives in a single process, so running several workers needs a
+    shared backend; Cosmos DB is used when an endpoint is configured.
+    """
+    if not config.COSMOSDB_ENDPOINT:
+        return MemoryStorage()
+
+    # botbuilder-azure is only required when Cosmos DB storage is configured
+    from botbuilder.azure import CosmosDbPartitionedConfig, CosmosDbPartitionedStorage
+
+    return CosmosDbPartitionedStorage(
+        CosmosDbPartitionedConfig(
+            cosmos_db_endpoint=config.COSMOSDB_ENDPOINT,
+            auth_key=config.COSMOSDB_AUTH_KEY,
+            database_id=config.COSMOSDB_DATABASE_ID,
+            container_id=config.COSMOSDB_CONTAINER_ID,
+        )
+    )
+
+
+# Create storage and state
+MEMORY = create_storage(CONFIG)
 USER_STATE = UserState(MEMORY)
 CONVERSATION_STATE = ConversationState(MEMORY)
 
@@ -101,45 +146,67 @@ BOT = AuthBot(CONVERSATION_STATE, USER_STATE, DIALOG)
 
 # Listen for incoming requests on /api/messages.
 async def messages(req: Request) -> Response:
+    log = logger
+
+    if "application/json" not in req.headers.get("Content-Type", ""):
+        return Response(status=HTTPStatus.UNSUPPORTED_MEDIA_TYPE)
+
+    # Read and parse the body once; the parsed activity is handed straight to the
+    # adapter so it does not have to read and deserialize the request again.
+    body = await req.read()
     try:
-        # Parse the request body to extract the activity
-        body = await req.text()
-        if body:
-            import json
-            activity_data = json.loads(body)
-            
-            # Log conversation ID and related information
-            conversation = activity_data.get('conversation', {})
-            conversation_id = conversation.get('id', 'Unknown')
-            conversation_name = conversation.get('name', 'N/A')
-            
-            # Log user information
-            from_user = activity_data.get('from', {})
-            user_id = from_user.get('id', 'Unknown')
-            user_name = from_user.get('name', 'N/A')
-            
-            # Log channel and activity information
-            channel_id = activity_data.get('channelId', 'Unknown')
-            activity_type = activity_data.get('type', 'Unknown')
-            activity_id = activity_data.get('id', 'Unknown')
-            
-            logger.info("=== Bot Activity Information ===")
-            logger.info(f"Conversation ID: {conversation_id}")
-            logger.info(f"Conversation Name: {conversation_name}")
-            logger.info(f"Activity ID: {activity_id}")
-            logger.info(f"Activity Type: {activity_type}")
-            logger.info(f"Channel ID: {channel_id}")
-            logger.info(f"User ID: {user_id}")
-            logger.info(f"User Name: {user_name}")
-            logger.info("=== End Activity Information ===")
-            
-    except Exception as e:
-        logger.warning(f"Failed to parse activity for logging: {e}")
-    
-    return await ADAPTER.process(req, BOT)
+        activity_data = json_helper.loads(body)
+    except (ValueError, TypeError) as e:
+        log.warning("Failed to parse activity: %s", e)
+        return Response(status=HTTPStatus.BAD_REQUEST)
+    if not isinstance(activity_data, dict):
+        return Response(status=HTTPStatus.BAD_REQUEST)
+
+    if log.isEnabledFor(logging.DEBUG):
+        get = activity_data.get
+        conversation = get('conversation') or {}
+        from_user = get('from') or {}
+
+        # One record per activity; the fields are also attached to the record
+        # so structured handlers can pick them up without parsing the message.
+        activity_info = {
+            "conversation_id": conversation.get('id', 'Unknown'),
+            "conversation_name": conversation.get('name', 'N/A'),
+            "activity_id": get('id', 'Unknown'),
+            "activity_type": get('type', 'Unknown'),
+            "channel_id": get('channelId', 'Unknown'),
+            "user_id": from_user.get('id', 'Unknown'),
+            "user_name": from_user.get('name', 'N/A'),
+        }
+        log.debug(
+            "Bot activity: conversation_id=%(conversation_id)s "
+            "conversation_name=%(conversation_name)s activity_id=%(activity_id)s "
+            "activity_type=%(activity_type)s channel_id=%(channel_id)s "
+            "user_id=%(user_id)s user_name=%(user_name)s",
+            activity_info,
+            extra=activity_info,
+        )
+
+    activity = Activity().deserialize(activity_data)
+    if not activity.type:
+        return Response(status=HTTPStatus.BAD_REQUEST)
+
+    auth_header = req.headers.get("Authorization", "")
+    try:
+        invoke_response = await ADAPTER.process_activity(auth_header, activity, BOT.on_turn)
+    except PermissionError:
+        return Response(status=HTTPStatus.UNAUTHORIZED)
+
+    if invoke_response:
+        return json_response(
+            data=serializer_helper(invoke_response.body),
+            status=invoke_response.status,
+        )
+    return Response(status=HTTPStatus.CREATED)
 
 APP = web.Application(middlewares=[aiohttp_error_middleware])
 APP.router.add_post("/api/messages", messages)
+APP.on_cleanup.append(close_shared_session)
 
 if __name__ == "__main__":
     try:
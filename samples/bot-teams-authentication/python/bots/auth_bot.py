@@ -1,7 +1,6 @@
 # Copyright (c) Microsoft Corporation. All rights reserved.
 # Licensed under the MIT License.
 
-import json
 import logging
 from typing import List
 from botbuilder.core import (
@@ -13,9 +12,18 @@ from botbuilder.core import (
 from botbuilder.dialogs import Dialog
 from botbuilder.schema import ChannelAccount, ActivityTypes, InvokeResponse
 
+import json_helper
 from helpers.dialog_helper import DialogHelper
 from .dialog_bot import DialogBot
 
+_WELCOME = (
+    "Welcome to AuthenticationBot. Type anything to get logged in. Type "
+    "'logout' to sign-out."
+)
+# TurnContext.send_activities() deep-copies activities before addressing them,
+# so a single prebuilt message can be shared by every turn.
+_WELCOME_ACTIVITY = MessageFactory.text(_WELCOME)
+
 
 class AuthBot(DialogBot):
     def __init__(
@@ -30,14 +38,12 @@ class AuthBot(DialogBot):
     async def on_members_added_activity(
         self, members_added: List[ChannelAccount], turn_context: TurnContext
     ):
-        for member in members_added:
-            # Greet anyone that was not the target (recipient) of this message.
-            # To learn more about Adaptive Cards, see https://aka.ms/msbot-adaptivecards for more details.
-            if member.id != turn_context.activity.recipient.id:
-                await turn_context.send_activity(
-                    "Welcome to AuthenticationBot. Type anything to get logged in. Type "
-                    "'logout' to sign-out."
-                )
+        # Greet the conversation once if anyone other than the bot (the recipient of
+        # this activity) joined; every greeting would go to the same conversation.
+        # To learn more about Adaptive Cards, see https://aka.ms/msbot-adaptivecards for more details.
+        recipient_id = turn_context.activity.recipient.id
+        if any(member.id != recipient_id for member in members_added):
+            await turn_context.send_activity(_WELCOME_ACTIVITY)
 
     async def on_token_response_event(self, turn_context: TurnContext):
         # Run the Dialog with the new Token Response Event Activity.
@@ -101,9 +107,9 @@ class AuthBot(DialogBot):
                 # Parse feedback text if it's JSON
                 if feedback_text:
                     try:
-                        feedback_json = json.loads(feedback_text)
+                        feedback_json = json_helper.loads(feedback_text)
                         feedback_text = feedback_json.get("feedbackText", feedback_text)
-                    except json.JSONDecodeError:
+                    except json_helper.JSONDecodeError:
                         pass  # Keep original text if not JSON
                 
                 # Log the feedback
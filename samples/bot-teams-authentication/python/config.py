@@ -18,4 +18,10 @@ class DefaultConfig:
     #APP_TYPE = os.environ.get("MicrosoftAppType", "SingleTenant")
     APP_TYPE = os.environ.get("MicrosoftAppType", "MultiTenant")
     APP_TENANTID = os.environ.get("MicrosoftAppTenantId", "<REDACTED>")
-    CONNECTION_NAME = os.environ.get("ConnectionName", "<REDACTED>")
\ No newline at end of file
+    CONNECTION_NAME = os.environ.get("ConnectionName", "<REDACTED>")
+    # Optional Cosmos DB storage for bot state. Leave the endpoint empty to keep
+    # state in memory (single process only).
+    COSMOSDB_ENDPOINT = os.environ.get("CosmosDbEndpoint", "")
+    COSMOSDB_AUTH_KEY = os.environ.get("CosmosDbAuthKey", "")
+    COSMOSDB_DATABASE_ID = os.environ.get("CosmosDbDatabaseId", "bot-db")
+    COSMOSDB_CONTAINER_ID = os.environ.get("CosmosDbContainerId", "bot-state")
\ No newline at end of file
@@ -2,251 +2,290 @@
 # Licensed under the MIT License.
 
 import logging
-import json
-import asyncio
+import itertools
+import re
+import time
 from typing import Any, Dict, Optional
-from aiohttp import ClientSession, ClientResponse, ClientTimeout
+from aiohttp import ClientSession
 import aiohttp
 
+import json_helper
+
+
+# Header names whose values must never be logged, matched case-insensitively
+# anywhere in the name (e.g. "Authorization", "X-Refresh-Token").
+_SENSITIVE_HEADER_RE = re.compile(
+    r"auth|x-api-key|x-auth-token|cookie|set-cookie|x-csrf-token|x-forwarded-for"
+    r"|token|secret|password",
+    re.IGNORECASE,
+)
+
+
+# Names of loggers that _ensure_handler_once() has already looked at.
+_configured_loggers = set()
+
+
+def _ensure_handler_once(logger: logging.Logger):
+    """Give ``logger`` a console handler the first time it is used, unless the
+    application has already configured the root logger."""
+    if logger.name in _configured_loggers:
+        return
+    _configured_loggers.add(logger.name)
+
+    # With root handlers in place, records simply propagate to them; adding our
+    # own handler as well would print every record twice.
+    if logging.getLogger().handlers:
+        return
+
+    handler = logging.StreamHandler()
+    handler.setFormatter(logging.Formatter(
+        '%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+    ))
+    logger.addHandler(handler)
+    # Keep a level the application set explicitly
+    if logger.level == logging.NOTSET:
+        logger.setLevel(logging.INFO)
+
 
 class HTTPLogger:
     """HTTP request/response logger for tracking all outgoing HTTP requests."""
     
     def __init__(self, logger_name: str = "HTTPLogger"):
         self.logger = logging.getLogger(logger_name)
-        self.logger.setLevel(logging.INFO)
-        
-        # Create formatter for HTTP logs
-        formatter = logging.Formatter(
-            '%(asctime)s - %(name)s - %(levelname)s - %(message)s'
-        )
-        
-        # Ensure we have a handler
-        if not self.logger.handlers:
-            handler = logging.StreamHandler()
-            handler.setFormatter(formatter)
-            self.logger.addHandler(handler)
+        _ensure_handler_once(self.logger)
 
     async def log_request(self, method: str, url: str, headers: Dict[str, Any], 
                          body: Optional[str], request_id: str):
         """Log outgoing HTTP request details."""
+        if not self.logger.isEnabledFor(logging.INFO):
+            return
+
         # Sanitize sensitive headers
         sanitized_headers = self._sanitize_headers(headers)
-        
-        self.logger.info("=== Outgoing HTTP Request ===")
-        self.logger.info(f"Request ID: {request_id}")
-        self.logger.info(f"Method: {method}")
-        self.logger.info(f"URL: {url}")
-        self.logger.info(f"Headers: {json.dumps(sanitized_headers, indent=2)}")
-        
-        if body:
-            # Try to format JSON body nicely, fallback to string
-            try:
-                if isinstance(body, (str, bytes)):
-                    if isinstance(body, bytes):
-                        body = body.decode('utf-8', errors='ignore')
-                    json_body = json.loads(body)
-                    self.logger.info(f"Body: {json.dumps(json_body, indent=2)}")
-                else:
-                    self.logger.info(f"Body: {json.dumps(body, indent=2)}")
-            except (json.JSONDecodeError, TypeError):
-                self.logger.info(f"Body (raw): {str(body)}")
-        else:
-            self.logger.info("Body: (empty)")
-        
-        self.logger.info("=== End Request ===")
+
+        lines = [
+            "=== Outgoing HTTP Request ===",
+            f"Request ID: {request_id}",
+            f"Method: {method}",
+            f"URL: {url}",
+            f"Headers: {json_helper.dumps(sanitized_headers)}",
+            self._format_body(body),
+            "=== End Request ===",
+        ]
+        self.logger.info("%s", "\n".join(lines))
 
     async def log_response(self, status: int, headers: Dict[str, Any], 
                           body: Optional[str], request_id: str, 
                           response_time_ms: float):
         """Log HTTP response details."""
+        if not self.logger.isEnabledFor(logging.INFO):
+            return
+
         # Sanitize sensitive headers
         sanitized_headers = self._sanitize_headers(headers)
-        
-        self.logger.info("=== HTTP Response ===")
-        self.logger.info(f"Request ID: {request_id}")
-        self.logger.info(f"Status Code: {status}")
-        self.logger.info(f"Response Time: {response_time_ms:.2f}ms")
-        self.logger.info(f"Headers: {json.dumps(sanitized_headers, indent=2)}")
-        
-        if body:
-            # Try to format JSON response nicely, fallback to string
-            try:
-                if isinstance(body, (str, bytes)):
-                    if isinstance(body, bytes):
-                        body = body.decode('utf-8', errors='ignore')
-                    json_body = json.loads(body)
-                    self.logger.info(f"Body: {json.dumps(json_body, indent=2)}")
-                else:
-                    self.logger.info(f"Body: {json.dumps(body, indent=2)}")
-            except (json.JSONDecodeError, TypeError):
-                self.logger.info(f"Body (raw): {str(body)}")
-        else:
-            self.logger.info("Body: (empty)")
-            
-        self.logger.info("=== End Response ===")
+
+        lines = [
+            "=== HTTP Response ===",
+            f"Request ID: {request_id}",
+            f"Status Code: {status}",
+            f"Response Time: {response_time_ms:.2f}ms",
+            f"Headers: {json_helper.dumps(sanitized_headers)}",
+            self._format_body(body),
+            "=== End Response ===",
+        ]
+        self.logger.info("%s", "\n".join(lines))
+
+    def _format_body(self, body: Any) -> str:
+        """Format a request/response body as a single log line."""
+        if not body:
+            return "Body: (empty)"
+
+        # Try to format JSON body nicely, fallback to string
+        try:
+            if isinstance(body, (str, bytes)):
+                if isinstance(body, bytes):
+                    body = body.decode('utf-8', errors='ignore')
+                json_body = json_helper.loads(body)
+                return f"Body: {json_helper.dumps(json_body)}"
+            return f"Body: {json_helper.dumps(body)}"
+        except (json_helper.JSONDecodeError, TypeError):
+            return f"Body (raw): {str(body)}"
 
     def _sanitize_headers(self, headers: Dict[str, Any]) -> Dict[str, Any]:
         """Remove or mask sensitive header values."""
-        sensitive_headers = {
-            'auth', 'x-api-key', 'x-auth-token', 
-            'cookie', 'set-cookie', 'x-csrf-token', 'x-forwarded-for'
+        return {
+            key: "[REDACTED]" if _SENSITIVE_HEADER_RE.search(key) else value
+            for key, value in headers.items()
         }
-        
-        sanitized = {}
-        for key, value in headers.items():
-            key_lower = key.lower()
-            if key_lower in sensitive_headers:
-                sanitized[key] = "[REDACTED]"
-            elif 'token' in key_lower or 'secret' in key_lower or 'password' in key_lower:
-                sanitized[key] = "[REDACTED]"
-            else:
-                sanitized[key] = value
-        
-        return sanitized
+
+
+# Connection pool sizing for Bot Framework traffic. Bots fan out to a handful of
+# hosts (the channel service, token endpoints, Graph), so the per-host limit is
+# what matters; aiohttp's default of 100 total connections would queue bursts.
+CONNECTOR_LIMIT = 0  # no global cap
+CONNECTOR_LIMIT_PER_HOST = 64
+CONNECTOR_DNS_CACHE_TTL = 300
+CONNECTOR_KEEPALIVE_TIMEOUT = 75
+
+
+def create_connector() -> aiohttp.TCPConnector:
+    """Create a TCPConnector tuned for Bot Framework traffic."""
+    return aiohttp.TCPConnector(
+        limit=CONNECTOR_LIMIT,
+        limit_per_host=CONNECTOR_LIMIT_PER_HOST,
+        ttl_dns_cache=CONNECTOR_DNS_CACHE_TTL,
+        keepalive_timeout=CONNECTOR_KEEPALIVE_TIMEOUT,
+        enable_cleanup_closed=True,
+    )
+
+
+# Process-wide connection pool. Sessions created without a connector borrow it
+# (connector_owner=False), so closing a per-call session keeps its keep-alive
+# connections, and their TLS sessions, for the next one.
+_SHARED_CONNECTOR: Optional[aiohttp.TCPConnector] = None
+
+
+def get_shared_connector() -> aiohttp.TCPConnector:
+    """Return the shared connector, creating it on first use.
+
+    Must be called from within a running event loop.
+    """
+    global _SHARED_CONNECTOR
+
+    if _SHARED_CONNECTOR is None or _SHARED_CONNECTOR.closed:
+        _SHARED_CONNECTOR = create_connector()
+    return _SHARED_CONNECTOR
+
+
+async def _on_request_start(session, trace_config_ctx, params):
+    """Tag the request with an ID and start time."""
+    trace_config_ctx.request_id = session._get_request_id()
+    trace_config_ctx.start_time = time.perf_counter_ns()
+    trace_config_ctx.body_chunks = []
+
+
+async def _on_request_chunk_sent(session, trace_config_ctx, params):
+    """Collect the request body as aiohttp writes it, without touching the payload."""
+    if session.http_logger.logger.isEnabledFor(logging.INFO):
+        trace_config_ctx.body_chunks.append(params.chunk)
+
+
+async def _on_request_end(session, trace_config_ctx, params):
+    """Log the request and the response status/headers once the headers arrive."""
+    response_time_ms = (time.perf_counter_ns() - trace_config_ctx.start_time) / 1e6
+
+    await session.http_logger.log_request(
+        method=params.method,
+        url=str(params.url),
+        headers=params.headers,
+        body=b"".join(trace_config_ctx.body_chunks),
+        request_id=trace_config_ctx.request_id
+    )
+    # The response body is left untouched so callers can still stream it
+    await session.http_logger.log_response(
+        status=params.response.status,
+        headers=params.response.headers,
+        body="[Response body not captured to keep the response stream intact]",
+        request_id=trace_config_ctx.request_id,
+        response_time_ms=response_time_ms
+    )
+
+
+async def _on_request_exception(session, trace_config_ctx, params):
+    """Log the request and the error that ended it."""
+    response_time_ms = (time.perf_counter_ns() - trace_config_ctx.start_time) / 1e6
+
+    await session.http_logger.log_request(
+        method=params.method,
+        url=str(params.url),
+        headers=params.headers,
+        body=b"".join(trace_config_ctx.body_chunks),
+        request_id=trace_config_ctx.request_id
+    )
+    session.http_logger.logger.error(
+        "=== HTTP Request Failed ===\n"
+        "Request ID: %s\n"
+        "Error: %s\n"
+        "Response Time: %.2fms\n"
+        "=== End Error ===",
+        trace_config_ctx.request_id, params.exception, response_time_ms
+    )
+
+
+# aiohttp calls these hooks around every request made by a LoggingClientSession.
+_TRACE_CONFIG = aiohttp.TraceConfig()
+_TRACE_CONFIG.on_request_start.append(_on_request_start)
+_TRACE_CONFIG.on_request_chunk_sent.append(_on_request_chunk_sent)
+_TRACE_CONFIG.on_request_end.append(_on_request_end)
+_TRACE_CONFIG.on_request_exception.append(_on_request_exception)
 
 
 class LoggingClientSession(ClientSession):
-    """aiohttp ClientSession wrapper that logs all HTTP requests and responses."""
-    
+    """aiohttp ClientSession that logs all HTTP requests and responses via trace hooks."""
+
+    # Shared by all sessions so request IDs are unique process-wide.
+    _id_gen = itertools.count(1)
+
     def __init__(self, *args, **kwargs):
+        # Sessions that don't bring their own connector share the process-wide
+        # pool instead of opening (and tearing down) one of their own.
+        if kwargs.get('connector') is None:
+            kwargs['connector'] = get_shared_connector()
+            kwargs['connector_owner'] = False
+        kwargs['trace_configs'] = [*(kwargs.get('trace_configs') or []), _TRACE_CONFIG]
         super().__init__(*args, **kwargs)
         self.http_logger = HTTPLogger("OutgoingHTTP")
-        self._request_counter = 0
 
     def _get_request_id(self) -> str:
         """Generate unique request ID for tracking."""
-        self._request_counter += 1
-        return f"req_{self._request_counter}_{id(self)}"
-
-    async def _request(self, method: str, url, **kwargs) -> ClientResponse:
-        """Override the internal _request method to add logging."""
-        import time
-        
-        request_id = self._get_request_id()
-        start_time = time.time()
-        
-        # Extract and log request details
-        headers = kwargs.get('headers', {})
-        if hasattr(headers, 'items'):
-            headers_dict = dict(headers.items())
-        else:
-            headers_dict = dict(headers) if headers else {}
-            
-        # Get request body
-        body = None
-        if 'data' in kwargs:
-            body = kwargs['data']
-        elif 'json' in kwargs:
-            body = kwargs['json']
-        
-        # Log the request
-        await self.http_logger.log_request(
-            method=method.upper(),
-            url=str(url),
-            headers=headers_dict,
-            body=body,
-            request_id=request_id
-        )
-        
-        try:
-            # Make the actual request
-            response = await super()._request(method, url, **kwargs)
-            
-            # Calculate response time
-            end_time = time.time()
-            response_time_ms = (end_time - start_time) * 1000
-            
-            # Get response headers
-            response_headers = dict(response.headers.items()) if response.headers else {}
-            
-            # Try to read response body for logging (without consuming it)
-            response_body = None
-            try:
-                # Read the response body
-                response_body = await response.text()
-                
-                # Create a new response object with the same data
-                # We need to recreate the response because aiohttp responses can only be read once
-                from aiohttp.streams import StreamReader
-                from aiohttp import ClientResponseError
-                import io
-                
-                # Create new response with the body we just read
-                class LoggedResponse(ClientResponse):
-                    def __init__(self, original_response, body_text):
-                        # Copy attributes from original response
-                        self._method = original_response._method
-                        self._url = original_response._url
-                        self._status = original_response._status
-                        self._reason = original_response._reason
-                        self._headers = original_response._headers
-                        self._history = original_response._history
-                        self._request_info = original_response._request_info
-                        self._connection = original_response._connection
-                        self._closed = original_response._closed
-                        self._body_text = body_text
-                        self._content = StreamReader(
-                            protocol=None, 
-                            limit=2**16,
-                            loop=asyncio.get_event_loop()
-                        )
-                        # Feed the body text back into the content stream
-                        if body_text:
-                            self._content.feed_data(body_text.encode('utf-8'))
-                        self._content.feed_eof()
-
-                    async def text(self, encoding='utf-8'):
-                        return self._body_text
-
-                    async def json(self, **kwargs):
-                        return json.loads(self._body_text) if self._body_text else None
-
-                    async def read(self):
-                        return self._body_text.encode('utf-8') if self._body_text else b''
-
-                # Create the logged response
-                logged_response = LoggedResponse(response, response_body)
-                
-                # Log the response
-                await self.http_logger.log_response(
-                    status=response.status,
-                    headers=response_headers,
-                    body=response_body,
-                    request_id=request_id,
-                    response_time_ms=response_time_ms
-                )
-                
-                return logged_response
-                
-            except Exception as read_error:
-                # If we can't read the response body, log without it
-                await self.http_logger.log_response(
-                    status=response.status,
-                    headers=response_headers,
-                    body=f"[ERROR READING BODY: {str(read_error)}]",
-                    request_id=request_id,
-                    response_time_ms=response_time_ms
-                )
-                return response
-                
-        except Exception as e:
-            # Log error
-            end_time = time.time()
-            response_time_ms = (end_time - start_time) * 1000
-            
-            self.http_logger.logger.error("=== HTTP Request Failed ===")
-            self.http_logger.logger.error(f"Request ID: {request_id}")
-            self.http_logger.logger.error(f"Error: {str(e)}")
-            self.http_logger.logger.error(f"Response Time: {response_time_ms:.2f}ms")
-            self.http_logger.logger.error("=== End Error ===")
-            
-            raise
+        return f"req_{next(self._id_gen)}"
+
+
+# Process-wide session for outgoing calls made by this sample's own code.
+_SHARED_SESSION: Optional[LoggingClientSession] = None
+
+
+def get_shared_session() -> LoggingClientSession:
+    """Return the shared logging session, creating it on first use.
+
+    Must be called from within a running event loop.
+    """
+    global _SHARED_SESSION
+
+    if _SHARED_SESSION is None or _SHARED_SESSION.closed:
+        _SHARED_SESSION = LoggingClientSession()
+    return _SHARED_SESSION
+
+
+async def close_shared_session(app=None):
+    """Close the shared session and connection pool.
+
+    Registered as an ``on_cleanup`` handler of the web app in app.py.
+    """
+    global _SHARED_SESSION, _SHARED_CONNECTOR
+
+    if _SHARED_SESSION is not None:
+        await _SHARED_SESSION.close()
+        _SHARED_SESSION = None
+    if _SHARED_CONNECTOR is not None:
+        await _SHARED_CONNECTOR.close()
+        _SHARED_CONNECTOR = None
 
 
 def patch_aiohttp_for_logging():
-    """Patch aiohttp to use our logging client session globally."""
-    import aiohttp
+    """Patch aiohttp to use our logging client session globally.
+
+    Returns the original ClientSession class, or None if the patch was skipped
+    because INFO logging is disabled for the "OutgoingHTTP" logger.
+    """
+    # Set the logger up as HTTPLogger would before checking its level, so a
+    # process without any logging configuration still gets INFO output
+    logger = logging.getLogger("OutgoingHTTP")
+    _ensure_handler_once(logger)
+
+    # Nothing would be logged, so don't pay for the tracing hooks
+    if not logger.isEnabledFor(logging.INFO):
+        return None
     
     # Store original ClientSession
     original_client_session = aiohttp.ClientSession
@@ -259,5 +298,5 @@ def patch_aiohttp_for_logging():
 
 def unpatch_aiohttp(original_client_session):
     """Restore original aiohttp ClientSession."""
-    import aiohttp
-    aiohttp.ClientSession = original_client_session
\ No newline at end of file
+    if original_client_session is not None:
+        aiohttp.ClientSession = original_client_session
\ No newline at end of file
@@ -0,0 +1,36 @@
+# Copyright (c) Microsoft Corporation. All rights reserved.
+# Licensed under the MIT License.
+
+import json
+from typing import Any, Callable, Optional
+
+try:
+    import orjson
+except ImportError:
+    # orjson is optional; fall back to the standard library
+    orjson = None
+
+# orjson.JSONDecodeError subclasses json.JSONDecodeError, so callers can catch
+# this regardless of which implementation is in use.
+JSONDecodeError = json.JSONDecodeError
+
+
+def loads(data: Any) -> Any:
+    """Parse JSON from ``str`` or ``bytes``."""
+    if orjson is not None:
+        return orjson.loads(data)
+    return json.loads(data)
+
+
+def dumps(
+    obj: Any, indent: bool = False, default: Optional[Callable[[Any], Any]] = None
+) -> str:
+    """Serialize ``obj`` to a JSON string, compact unless ``indent`` is set."""
+    if orjson is not None:
+        option = orjson.OPT_NON_STR_KEYS
+        if indent:
+            option |= orjson.OPT_INDENT_2
+        return orjson.dumps(obj, default=default, option=option).decode()
+    if indent:
+        return json.dumps(obj, indent=2, default=default)
+    return json.dumps(obj, separators=(",", ":"), default=default)
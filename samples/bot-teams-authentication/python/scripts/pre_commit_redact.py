@@ -17,35 +17,81 @@ Notes:
 """
 
 from __future__ import annotations
+import mmap
 import subprocess
 import sys
 import os
 import re
-from typing import List
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, Iterator, List, Optional
 
 GIT = "git"
 
-# Regex patterns to find secrets. Each pattern should have a capture group for the
-# "prefix" (the left-hand side and assignment operator) and the secret value as
-# a following group.
+# Regex patterns to find secrets. Each pattern captures the "prefix" (the
+# left-hand side and assignment operator) and the opening quote, if any, ahead of
+# the secret value. They are applied in order, each to the output of the one
+# before: an ENV line whose value contains the other quote character is only
+# partly matched by the KV pattern, and the ENV pass then redacts the rest of it.
+# Patterns are bytes so file contents can be scanned without decoding them.
 PATTERNS = [
     # JSON / JS / PY style: "clientSecret": "<REDACTED>"  or client_secret = '<REDACTED>'
-    re.compile(r'(?im)("?(?:client[_\-]?secret|clientSecret|client_secret|clientSecretValue|client-secret|secret|api[_\-]?key|apiKey|access[_\-]?token|auth[_\-]?token|password|pwd)"?\s*[:=]\s*)(["\'])([^"\']{4,})(["\'])'),
+    rb'(?im)(?P<prefix>"?(?:client[_\-]?secret|clientSecret|client_secret|clientSecretValue|client-secret|secret|api[_\-]?key|apiKey|access[_\-]?token|auth[_\-]?token|password|pwd)"?\s*[:=]\s*)(?P<quote>["\'])[^"\']{4,}["\']',
     # ENV style: SECRET_KEY=abc123
-    re.compile(r'(?im)(^\s*(?:AWS_SECRET_ACCESS_KEY|AWS_SECRET|SECRET_KEY|SECRET|TOKEN|ACCESS_TOKEN|API_KEY|PRIVATE_KEY)\s*[:=]\s*)(["\']?)([^#\n\r]+)(["\']?)'),
+    rb'(?im)(?P<prefix>^\s*(?:AWS_SECRET_ACCESS_KEY|AWS_SECRET|SECRET_KEY|SECRET|TOKEN|ACCESS_TOKEN|API_KEY|PRIVATE_KEY)\s*[:=]\s*)(?P<quote>["\']?)[^#\n\r]+["\']?',
 ]
+# In a bytes pattern \s only matches ASCII whitespace. Widen it to everything \s
+# matches in decoded text: the \x1c-\x1f separators, and the UTF-8 forms of
+# U+0085, U+00A0, U+1680, U+2000-U+200A, U+2028, U+2029, U+202F, U+205F and
+# U+3000. The one remaining difference from matching decoded text is Unicode
+# case folding: keywords spelled with U+017F (long s), U+212A (Kelvin sign) or a
+# dotted/dotless I are not recognised.
+_WS = (
+    rb"(?:[\s\x1c-\x1f]|\xc2[\x85\xa0]|\xe1\x9a\x80|\xe2\x80[\x80-\x8a\xa8\xa9\xaf]"
+    rb"|\xe2\x81\x9f|\xe3\x80\x80)"
+)
+PATTERNS = [re.compile(p.replace(rb"\s", _WS)) for p in PATTERNS]
 
+# Keywords that every match of PATTERNS contains; text without any of them
+# cannot match.
+_PREFILTER = re.compile(rb"secret|api[_\-]?key|token|password|pwd|private_key", re.IGNORECASE)
 
-def run(cmd: List[str]) -> str:
-    return subprocess.check_output(cmd, text=True).strip()
 
+def run(cmd: List[str]) -> bytes:
+    return subprocess.check_output(cmd)
 
-def list_staged_files() -> List[str]:
+
+def decode_path(path: bytes) -> str:
+    # Paths from `git ... -z` output are NUL-terminated and unquoted; bytes that
+    # are not valid UTF-8 survive the round trip through surrogateescape.
+    return path.decode("utf-8", "surrogateescape")
+
+
+def split_paths(out: bytes) -> List[str]:
+    return [decode_path(p) for p in out.split(b"\0") if p]
+
+
+def encode_path(path: str) -> bytes:
+    return path.encode("utf-8", "surrogateescape")
+
+
+def list_staged_blobs() -> Dict[str, bytes]:
+    """Map each added, copied or modified staged path to the object ID of its
+    staged blob, in the order git lists them."""
+    blobs: Dict[str, bytes] = {}
     try:
-        out = run([GIT, "diff", "--cached", "--name-only", "--diff-filter=ACM"])
-        return [line for line in out.splitlines() if line]
+        out = run([GIT, "diff", "--cached", "--raw", "-z", "--no-abbrev", "--diff-filter=ACM"])
     except subprocess.CalledProcessError:
-        return []
+        return blobs
+    fields = out.split(b"\0")
+    i = 0
+    while i < len(fields) and fields[i]:
+        # ":<old mode> <new mode> <old oid> <new oid> <status>", then the path;
+        # copies list the source path before the new one
+        info = fields[i].split(b" ")
+        i += 2 if info[4].startswith(b"C") else 1
+        blobs[decode_path(fields[i])] = info[3]
+        i += 1
+    return blobs
 
 
 def list_worktree_files() -> List[str]:
@@ -58,14 +104,14 @@ def list_worktree_files() -> List[str]:
     files = []
     try:
         # modified tracked files
-        out = run([GIT, "ls-files", "-m"])
-        files.extend([line for line in out.splitlines() if line])
+        out = run([GIT, "ls-files", "-m", "-z"])
+        files.extend(split_paths(out))
     except subprocess.CalledProcessError:
         pass
     try:
         # untracked files (not ignored)
-        out = run([GIT, "ls-files", "--others", "--exclude-standard"])
-        files.extend([line for line in out.splitlines() if line])
+        out = run([GIT, "ls-files", "--others", "--exclude-standard", "-z"])
+        files.extend(split_paths(out))
     except subprocess.CalledProcessError:
         pass
     # dedupe while preserving order
@@ -78,96 +124,190 @@ def list_worktree_files() -> List[str]:
     return res
 
 
+def list_index_blobs(paths: List[str]) -> Dict[str, bytes]:
+    """Map each of ``paths`` that is in the index to the object ID of its staged
+    blob.
+
+    Conflicted paths (stages 1-3) are left out, as `git show :path` would fail
+    for them too.
+    """
+    blobs: Dict[str, bytes] = {}
+    if not paths:
+        return blobs
+    try:
+        out = run([GIT, "--literal-pathspecs", "ls-files", "-s", "-z", "--", *paths])
+    except subprocess.CalledProcessError:
+        return blobs
+    # each entry: "<mode> <oid> <stage>\t<path>"
+    for entry in out.split(b"\0"):
+        if not entry:
+            continue
+        info, _, path = entry.partition(b"\t")
+        _, oid, stage = info.split(b" ")
+        if stage == b"0":
+            blobs[decode_path(path)] = oid
+    return blobs
+
+
+def iter_staged_blobs(
+    paths: List[str], oids: Dict[str, bytes]
+) -> Iterator[tuple[str, Optional[bytes]]]:
+    """Yield each path with its staged (index) content, one blob at a time.
+
+    All blobs are read through a single `git cat-file --batch` process instead
+    of one `git show` per file. The process is asked for the object IDs in
+    ``oids`` rather than `:<path>` names, which its line-based input cannot
+    carry for paths containing a newline. Paths without an object ID, or whose
+    object is not a blob, are yielded with None.
+    """
+    with subprocess.Popen(
+        [GIT, "cat-file", "--batch"], stdin=subprocess.PIPE, stdout=subprocess.PIPE
+    ) as proc:
+        for path in paths:
+            oid = oids.get(path)
+            if oid is None:
+                yield path, None
+                continue
+            proc.stdin.write(oid + b"\n")
+            proc.stdin.flush()
+            # header: "<oid> <type> <size>", or "<oid> missing"
+            header = proc.stdout.readline().split()
+            if not header:
+                # cat-file exited early; remaining paths fall back to disk
+                oids = {}
+                yield path, None
+                continue
+            if len(header) != 3:
+                yield path, None
+                continue
+            content = proc.stdout.read(int(header[2]))
+            proc.stdout.read(1)  # trailing newline after the content
+            yield path, content if header[1] == b"blob" else None
+        proc.stdin.close()
+
+
+# Bytes that may appear in text: everything except the C0 control characters
+# other than \t \n \v \f \r. Deleting them from a sample leaves only the
+# suspicious bytes.
+_TEXT_BYTES = bytes(range(9, 14)) + bytes(range(32, 256))
+_BINARY_SAMPLE_SIZE = 8192
+
+
 def is_binary(content: bytes) -> bool:
-    # Heuristic: if it contains a NUL byte or a long sequence of non-text bytes
-    if b"\x00" in content:
+    # Heuristic on the first 8 KB: a NUL byte, or more than 30% control bytes
+    head = content[:_BINARY_SAMPLE_SIZE]
+    if b"\x00" in head:
         return True
-    # Try decode as utf-8
-    try:
-        content.decode("utf-8")
+    if not head:
         return False
-    except UnicodeDecodeError:
-        return True
+    return len(head.translate(None, _TEXT_BYTES)) / len(head) > 0.30
 
 
-def redact_content(text: str) -> tuple[str, int]:
-    total = 0
+def _repl(m: re.Match) -> bytes:
+    # rebuild: prefix + "<REDACTED>" (keep surrounding quotes if present)
+    quote = m.group("quote") or b""
+    return m.group("prefix") + quote + b"<REDACTED>" + quote
+
+
+def redact_content(content: bytes) -> tuple[bytes, int]:
+    # Two-stage scan: most files contain none of the keywords, so a plain keyword
+    # search rules them out before the capturing regexes run.
+    if not _PREFILTER.search(content):
+        return content, 0
 
-    def make_repl(prefix_group_index: int = 1):
-        def repl(m: re.Match) -> str:
-            nonlocal total
-            # rebuild: prefix + "<REDACTED>" (keep surrounding quotes if present)
-            groups = m.groups()
-            # groups: (prefix, quote1, secret, quote2) or similar
-            # We'll preserve the quote characters when present.
-            prefix = m.group(1)
-            # find the quote char if any at group 2; if it's a quote, keep it
-            quote = ""
-            try:
-                quote = m.group(2) if m.group(2) is not None else ""
-            except IndexError:
-                quote = ""
-            total += 1
-            return f"{prefix}{quote}<REDACTED>{quote}"
-
-        return repl
-
-    new_text = text
+    total = 0
     for pat in PATTERNS:
-        new_text, count = pat.subn(make_repl(), new_text)
-        total += 0  # count accounted in repl
-    return new_text, total
+        content, count = pat.subn(_repl, content)
+        total += count
+    return content, total
+
+
+def scan_content(content: bytes) -> Optional[tuple[bytes, int]]:
+    """Return the redacted content and number of redactions, or None if the
+    content is binary or nothing needs to change."""
+    if is_binary(content):
+        return None
+    new_content, total = redact_content(content)
+    # content[:] is the object itself for bytes and a copy for mmap; only files
+    # with hits get this far.
+    if total > 0 and new_content != content[:]:
+        return new_content, total
+    return None
+
+
+def _scan_file(path: str) -> Optional[tuple[bytes, int]]:
+    """Scan the working tree copy of ``path``, for files that are not in the index."""
+    if os.path.getsize(path) == 0:
+        # nothing to scan (and empty files cannot be mapped)
+        return None
+    # map the file instead of reading a copy into memory
+    with open(path, "rb") as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+        return scan_content(mm)
+
+
+def write_redacted(
+    path: str, result: Optional[tuple[bytes, int]], redacted_files: List[tuple[str, int]]
+) -> None:
+    if result is None:
+        return
+    new_content, total = result
+    # Write redacted content to working tree
+    with open(path, "wb") as f:
+        f.write(new_content)
+    redacted_files.append((path, total))
 
 
 def main() -> int:
     # By default we operate on staged files. Set SCAN_WORKTREE=1 to instead
     # scan modified/untracked files in the working tree (useful if you forgot
     # to stage files and want to clean them before committing).
-    if os.getenv("SCAN_WORKTREE", "0") == "1":
+    scan_worktree = os.getenv("SCAN_WORKTREE", "0") == "1"
+    if scan_worktree:
         files = list_worktree_files()
     else:
-        files = list_staged_files()
+        # one call gives both the staged paths and their blob IDs
+        oids = list_staged_blobs()
+        files = list(oids)
     if not files:
         # nothing staged
         return 0
 
     redacted_files = []
 
-    for path in files:
-        # Only operate on files that exist in the working tree (skip deleted files)
-        if not os.path.exists(path):
-            continue
-        # Get the staged content; fallback to working tree if show fails
-        try:
-            blob = subprocess.check_output([GIT, "show", f":{path}"], text=False)
-        except subprocess.CalledProcessError:
-            # file might be new and not yet in index; read from disk
-            with open(path, "rb") as f:
-                blob = f.read()
+    # Only operate on files that exist in the working tree (skip deleted files)
+    files = [path for path in files if os.path.exists(path)]
+    if scan_worktree:
+        oids = list_index_blobs(files)
 
-        if is_binary(blob):
-            continue
+    # Staged blobs are scanned as they stream in, one at a time, so memory use
+    # follows the largest file rather than the whole commit. That is regex work
+    # under the GIL, so it runs inline. Files that have to be read from disk go
+    # to a small thread pool, where page faults on one mapped file can overlap
+    # with scanning another.
+    disk_paths = []
+    for path, blob in iter_staged_blobs(files, oids):
+        if blob is None:
+            disk_paths.append(path)
+        else:
+            write_redacted(path, scan_content(blob), redacted_files)
+    if disk_paths:
+        with ThreadPoolExecutor(max_workers=min(8, len(disk_paths))) as pool:
+            for path, result in zip(disk_paths, pool.map(_scan_file, disk_paths)):
+                write_redacted(path, result, redacted_files)
 
+    if redacted_files:
+        # Stage all updated files with a single git invocation
+        pathspec = b"\0".join(encode_path(p) for p, _ in redacted_files)
         try:
-            text = blob.decode("utf-8")
-        except UnicodeDecodeError:
-            # Skip files we can't decode
-            continue
-
-        new_text, total = redact_content(text)
-        if total > 0 and new_text != text:
-            # Write redacted content to working tree
-            with open(path, "w", encoding="utf-8") as f:
-                f.write(new_text)
-            # Stage updated file
-            try:
-                subprocess.check_call([GIT, "add", path])
-            except subprocess.CalledProcessError:
-                print(f"Failed to git add {path}")
-                return 1
-            redacted_files.append((path, total))
+            subprocess.run(
+                [GIT, "add", "--pathspec-from-file=-", "--pathspec-file-nul"],
+                input=pathspec,
+                check=True,
+            )
+        except subprocess.CalledProcessError:
+            print("Failed to git add " + ", ".join(p for p, _ in redacted_files))
+            return 1
 
-    if redacted_files:
         print("Pre-commit redaction applied to staged files:")
         for p, c in redacted_files:
             print(f" - {p}: {c} secrets redacted")
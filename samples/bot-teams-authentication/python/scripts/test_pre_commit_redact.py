@@ -0,0 +1,45 @@
+"""Regression checks for pre_commit_redact.py. Run with `python -m pytest scripts`."""
+
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from pre_commit_redact import redact_content  # noqa: E402
+
+
+def test_env_value_containing_other_quote_is_fully_redacted():
+    # The KV pattern stops at the inner quote; the ENV pass must still wipe
+    # the rest of the line.
+    cases = {
+        b"SECRET=\"pa$$wo'rd-remainder-of-secret\"\n": b'SECRET="<REDACTED>"\n',
+        b"API_KEY=\"sk-ab'9f8e7d6c\"\n": b'API_KEY="<REDACTED>"\n',
+        b"ACCESS_TOKEN='abcd\"efgh1234'\n": b"ACCESS_TOKEN='<REDACTED>'\n",
+    }
+    for content, expected in cases.items():
+        new_content, total = redact_content(content)
+        assert new_content == expected
+        assert total > 0
+
+
+def test_kv_and_env_styles():
+    assert redact_content(b'{"clientSecret": "abcd1234"}\n')[0] == b'{"clientSecret": "<REDACTED>"}\n'
+    assert redact_content(b"SECRET_KEY=abc123\nother=1\n")[0] == b"SECRET_KEY=<REDACTED>\nother=1\n"
+
+
+def test_clean_content_is_untouched():
+    assert redact_content(b"x = 1\n") == (b"x = 1\n", 0)
+
+
+def test_unicode_whitespace_before_env_key_is_redacted():
+    # \s matched these in the original text-based patterns
+    for space in ("\u00a0", "\u0085", "\u2003", "\u3000"):
+        content = f"{space}API_KEY=abc123\n".encode("utf-8")
+        assert redact_content(content) == (f"{space}API_KEY=<REDACTED>\n".encode("utf-8"), 1)
+
+
+def test_unicode_case_folded_keywords_are_a_known_gap():
+    # Byte patterns do no Unicode case folding, so a keyword spelled with a long
+    # s (U+017F) is not recognised, unlike with the original text patterns.
+    content = "\u017fECRET=abc123\n".encode("utf-8")
+    assert redact_content(content) == (content, 0)
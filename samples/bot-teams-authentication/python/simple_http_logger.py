@@ -1,53 +1,108 @@
 # Copyright (c) Microsoft Corporation. All rights reserved.
 # Licensed under the MIT License.
 
+import itertools
 import logging
-import json
+import re
 import asyncio
 import time
-from typing import Any, Dict, Optional, Union
+from functools import lru_cache
+from typing import Any, Dict, Mapping, Optional, Union
 from aiohttp import ClientSession, ClientResponse
-import uuid
+from multidict import CIMultiDict, CIMultiDictProxy
 import urllib.parse
 
+import json_helper
+
+
+# URL fragments of OAuth/token endpoints
+_OAUTH_URL_RE = re.compile(
+    r"/oauth|/token|/auth|/login|login\.microsoftonline\.com|api\.botframework\.com"
+    r"|graph\.microsoft\.com|/v2\.0/token|/common/oauth2",
+    re.IGNORECASE,
+)
+# Request body parameters used by OAuth token requests, for str and bytes bodies
+_OAUTH_BODY_PATTERN = (
+    "grant_type|client_id|client_secret|access_token|refresh_token"
+    "|authorization_code|client_credentials"
+)
+_OAUTH_BODY_RE = re.compile(_OAUTH_BODY_PATTERN, re.IGNORECASE)
+_OAUTH_BODY_BYTES_RE = re.compile(_OAUTH_BODY_PATTERN.encode(), re.IGNORECASE)
+_OAUTH_BODY_KEYS = frozenset(_OAUTH_BODY_PATTERN.split("|"))
+# OAuth token requests are small; bigger bodies are not scanned for parameters
+_OAUTH_BODY_SCAN_LIMIT = 8192
+_BEARER_RE = re.compile("bearer", re.IGNORECASE)
+# Headers whose values are never logged, plus any header name containing these words
+_SENSITIVE_HEADERS = frozenset({
+    'auth', 'authorization', 'proxy-authorization', 'x-api-key', 'x-auth-token',
+    'cookie', 'set-cookie', 'x-csrf-token', 'x-forwarded-for'
+})
+_SENSITIVE_SUB_RE = re.compile("token|secret|password|key", re.IGNORECASE)
+
+
+@lru_cache(maxsize=512)
+def _url_is_oauth(url: str) -> bool:
+    """Match a URL against the OAuth endpoint patterns; the same endpoints are
+    called over and over, so results are cached."""
+    return _OAUTH_URL_RE.search(url) is not None
+
+
+class _LazyJson:
+    """Defers JSON pretty-printing until a handler actually formats the record."""
+
+    __slots__ = ("obj",)
+
+    def __init__(self, obj: Any):
+        self.obj = obj
+
+    def __str__(self) -> str:
+        try:
+            return json_helper.dumps(self.obj, indent=True, default=str)
+        except (TypeError, ValueError):
+            return str(self.obj)
+
 
 class SimpleHTTPLogger:
     """Simple HTTP request/response logger."""
     
     def __init__(self, logger_name: str = "HTTPLogger"):
         self.logger = logging.getLogger(logger_name)
-        self.logger.setLevel(logging.INFO)
 
-    def log_request(self, method: str, url: str, headers: Dict[str, Any], 
-                   body: Any, request_id: str):
-        """Log outgoing HTTP request details with special handling for OAuth requests."""
+    def log_request(self, method: str, url: str, headers: Mapping[str, Any], 
+                   body: Any, request_id: str) -> bool:
+        """Log outgoing HTTP request details with special handling for OAuth requests.
+
+        Returns whether the request was logged as an OAuth request, so callers
+        can pass it on to log_response without detecting it again.
+        """
+        if not self.logger.isEnabledFor(logging.INFO):
+            return False
+
         # Check if this is an OAuth-related request
         is_oauth_request = self._is_oauth_request(url, headers, body)
         
         sanitized_headers = self._sanitize_headers(headers)
         
+        # Collect the entry and emit it as a single record
         if is_oauth_request:
-            self.logger.info("=== OAUTH HTTP REQUEST ===")
+            lines = ["=== OAUTH HTTP REQUEST ==="]
         else:
-            self.logger.info("=== Outgoing HTTP Request ===")
-            
-        self.logger.info(f"Request ID: {request_id}")
-        self.logger.info(f"Method: {method}")
-        self.logger.info(f"URL: {url}")
+            lines = ["=== Outgoing HTTP Request ==="]
+        lines += ["Request ID: %s", "Method: %s", "URL: %s"]
+        args = [request_id, method, url]
         
         if is_oauth_request:
-            self.logger.info("OAuth Request Type: Detected")
+            lines.append("OAuth Request Type: Detected")
             # For OAuth requests, we want to see more header details (but still sanitized)
-            self.logger.info(f"Headers (OAuth): {json.dumps(sanitized_headers, indent=2, default=str)}")
+            lines.append("Headers (OAuth): %s")
         else:
-            self.logger.info(f"Headers: {json.dumps(sanitized_headers, indent=2, default=str)}")
+            lines.append("Headers: %s")
+        args.append(_LazyJson(sanitized_headers))
         
         if body is not None:
-            body_logged = False
-            
             # Special handling for OAuth body content
             if is_oauth_request:
-                self.logger.info("OAuth Body Content:")
+                lines.append("OAuth Body Content:")
                 
             try:
                 if isinstance(body, (str, bytes)):
@@ -58,157 +113,154 @@ class SimpleHTTPLogger:
                     
                     # Try to parse as JSON for pretty printing
                     try:
-                        json_body = json.loads(body_str)
+                        json_body = json_helper.loads(body_str)
                         if is_oauth_request:
                             # For OAuth, log with special formatting
-                            self.logger.info(f"Body (OAuth JSON): {json.dumps(json_body, indent=2, default=str)}")
+                            lines.append("Body (OAuth JSON): %s")
                         else:
-                            self.logger.info(f"Body: {json.dumps(json_body, indent=2, default=str)}")
-                        body_logged = True
-                    except json.JSONDecodeError:
+                            lines.append("Body: %s")
+                        args.append(_LazyJson(json_body))
+                    except json_helper.JSONDecodeError:
                         # Handle URL-encoded OAuth data (common for token requests)
                         if is_oauth_request and ('grant_type' in body_str or 'client_id' in body_str):
-                            self.logger.info(f"Body (OAuth URL-encoded): {body_str}")
+                            lines.append("Body (OAuth URL-encoded): %s")
                         else:
-                            self.logger.info(f"Body (raw): {body_str}")
-                        body_logged = True
+                            lines.append("Body (raw): %s")
+                        args.append(body_str)
                 elif isinstance(body, dict):
                     # Handle dict bodies (common with aiohttp json parameter)
                     if is_oauth_request:
-                        self.logger.info(f"Body (OAuth Dict): {json.dumps(body, indent=2, default=str)}")
+                        lines.append("Body (OAuth Dict): %s")
                     else:
-                        self.logger.info(f"Body: {json.dumps(body, indent=2, default=str)}")
-                    body_logged = True
+                        lines.append("Body: %s")
+                    args.append(_LazyJson(body))
                 else:
                     # Handle other body types
                     if is_oauth_request:
-                        self.logger.info(f"Body (OAuth Other): {json.dumps(body, indent=2, default=str)}")
+                        lines.append("Body (OAuth Other): %s")
                     else:
-                        self.logger.info(f"Body: {json.dumps(body, indent=2, default=str)}")
-                    body_logged = True
+                        lines.append("Body: %s")
+                    args.append(_LazyJson(body))
                     
-            except Exception as e:
-                self.logger.info(f"Body (error parsing): {str(body)}")
-                body_logged = True
-                
-            if not body_logged:
-                self.logger.info(f"Body (fallback): {str(body)}")
+            except Exception:
+                lines.append("Body (error parsing): %s")
+                args.append(body)
         else:
-            self.logger.info("Body: (empty)")
+            lines.append("Body: (empty)")
         
         if is_oauth_request:
-            self.logger.info("=== END OAUTH REQUEST ===")
+            lines.append("=== END OAUTH REQUEST ===")
         else:
-            self.logger.info("=== End Request ===")
+            lines.append("=== End Request ===")
+        
+        self.logger.info("\n".join(lines), *args)
+        return is_oauth_request
 
-    def log_response(self, status: int, headers: Dict[str, Any], 
+    def log_response(self, status: int, headers: Mapping[str, Any], 
                     body: Optional[str], request_id: str, 
                     response_time_ms: float, is_oauth_response: bool = False):
         """Log HTTP response details with special handling for OAuth responses."""
+        if not self.logger.isEnabledFor(logging.INFO):
+            return
+
         sanitized_headers = self._sanitize_headers(headers)
         
+        # Collect the entry and emit it as a single record
         if is_oauth_response:
-            self.logger.info("=== OAUTH HTTP RESPONSE ===")
+            lines = ["=== OAUTH HTTP RESPONSE ==="]
         else:
-            self.logger.info("=== HTTP Response ===")
-            
-        self.logger.info(f"Request ID: {request_id}")
-        self.logger.info(f"Status Code: {status}")
-        self.logger.info(f"Response Time: {response_time_ms:.2f}ms")
+            lines = ["=== HTTP Response ==="]
+        lines += ["Request ID: %s", "Status Code: %s", "Response Time: %.2fms"]
+        args = [request_id, status, response_time_ms]
         
         if is_oauth_response:
-            self.logger.info(f"Headers (OAuth): {json.dumps(sanitized_headers, indent=2, default=str)}")
+            lines.append("Headers (OAuth): %s")
         else:
-            self.logger.info(f"Headers: {json.dumps(sanitized_headers, indent=2, default=str)}")
+            lines.append("Headers: %s")
+        args.append(_LazyJson(sanitized_headers))
         
         if body:
             try:
                 # Try to parse as JSON for pretty printing
-                json_body = json.loads(body)
+                json_body = json_helper.loads(body)
                 if is_oauth_response:
-                    self.logger.info(f"Body (OAuth JSON): {json.dumps(json_body, indent=2, default=str)}")
+                    lines.append("Body (OAuth JSON): %s")
                 else:
-                    self.logger.info(f"Body: {json.dumps(json_body, indent=2, default=str)}")
-            except json.JSONDecodeError:
+                    lines.append("Body: %s")
+                args.append(_LazyJson(json_body))
+            except json_helper.JSONDecodeError:
                 if is_oauth_response:
-                    self.logger.info(f"Body (OAuth raw): {body}")
+                    lines.append("Body (OAuth raw): %s")
                 else:
-                    self.logger.info(f"Body (raw): {body}")
+                    lines.append("Body (raw): %s")
+                args.append(body)
         else:
-            self.logger.info("Body: (empty)")
+            lines.append("Body: (empty)")
             
         if is_oauth_response:
-            self.logger.info("=== END OAUTH RESPONSE ===")
+            lines.append("=== END OAUTH RESPONSE ===")
         else:
-            self.logger.info("=== End Response ===")
+            lines.append("=== End Response ===")
+        
+        self.logger.info("\n".join(lines), *args)
 
     def log_error(self, request_id: str, error: str, response_time_ms: float):
         """Log HTTP request error."""
-        self.logger.error("=== HTTP Request Failed ===")
-        self.logger.error(f"Request ID: {request_id}")
-        self.logger.error(f"Error: {error}")
-        self.logger.error(f"Response Time: {response_time_ms:.2f}ms")
-        self.logger.error("=== End Error ===")
+        self.logger.error(
+            "=== HTTP Request Failed ===\n"
+            "Request ID: %s\n"
+            "Error: %s\n"
+            "Response Time: %.2fms\n"
+            "=== End Error ===",
+            request_id, error, response_time_ms
+        )
     
-    def is_oauth_request(self, url: str, headers: Dict[str, Any], body: Any) -> bool:
+    def is_oauth_request(self, url: str, headers: Mapping[str, Any], body: Any) -> bool:
         """Public wrapper for OAuth request detection."""
         return self._is_oauth_request(url, headers, body)
 
-    def _is_oauth_request(self, url: str, headers: Dict[str, Any], body: Any) -> bool:
+    def _is_oauth_request(self, url: str, headers: Mapping[str, Any], body: Any) -> bool:
         """Detect if this is an OAuth-related request."""
-        url_lower = url.lower()
-        
         # Check URL patterns for OAuth endpoints
-        oauth_url_patterns = [
-            '/oauth',
-            '/token',
-            '/auth',
-            '/login',
-            'login.microsoftonline.com',
-            'api.botframework.com',
-            'graph.microsoft.com',
-            '/v2.0/token',
-            '/common/oauth2'
-        ]
-        
-        if any(pattern in url_lower for pattern in oauth_url_patterns):
+        if _url_is_oauth(url):
             return True
             
-        # Check headers for OAuth-related content
-        for key, value in headers.items():
-            if key.lower() == 'authorization' and value and 'bearer' in str(value).lower():
-                return True
-                
-        # Check body content for OAuth parameters
-        if body:
-            body_str = str(body).lower()
-            oauth_body_patterns = [
-                'grant_type',
-                'client_id',
-                'client_secret',
-                'access_token',
-                'refresh_token',
-                'authorization_code',
-                'client_credentials'
-            ]
-            if any(pattern in body_str for pattern in oauth_body_patterns):
-                return True
+        # Check the Authorization header for a bearer token
+        auth = self._get_authorization(headers)
+        if auth and _BEARER_RE.search(str(auth)):
+            return True
                 
-        return False
+        # Check body content for OAuth parameters; URL and header usually decide,
+        # so large bodies are not scanned at all
+        if not body:
+            return False
+        if isinstance(body, dict):
+            return any(key in body for key in _OAUTH_BODY_KEYS)
+        if not isinstance(body, (str, bytes)):
+            body = str(body)
+        if len(body) > _OAUTH_BODY_SCAN_LIMIT:
+            return False
+        if isinstance(body, bytes):
+            return _OAUTH_BODY_BYTES_RE.search(body) is not None
+        return _OAUTH_BODY_RE.search(body) is not None
 
-    def _sanitize_headers(self, headers: Dict[str, Any]) -> Dict[str, Any]:
-        """Remove or mask sensitive header values."""
-        sensitive_headers = {
-            'auth', 'x-api-key', 'x-auth-token', 
-            'cookie', 'set-cookie', 'x-csrf-token', 'x-forwarded-for'
-        }
-        
+    def _get_authorization(self, headers: Mapping[str, Any]) -> Any:
+        """Return the Authorization header value in any letter case, or None."""
+        if isinstance(headers, (CIMultiDict, CIMultiDictProxy)):
+            # aiohttp's CIMultiDict already looks names up case-insensitively;
+            # a plain MultiDict does not, so it takes the scan below
+            return headers.get('Authorization')
+        auth = headers.get('Authorization')
+        if auth is None:
+            auth = next((value for key, value in headers.items()
+                         if key.lower() == 'authorization'), None)
+        return auth
+
+    def _sanitize_headers(self, headers: Mapping[str, Any]) -> Dict[str, Any]:
+        """Return a masked copy of any header mapping (dict, CIMultiDict, ...)."""
         sanitized = {}
         for key, value in headers.items():
-            key_lower = key.lower()
-            if key_lower in sensitive_headers:
-                sanitized[key] = "[REDACTED]"
-            elif any(sensitive in key_lower for sensitive in ['token', 'secret', 'password', 'key']):
+            if key.lower() in _SENSITIVE_HEADERS or _SENSITIVE_SUB_RE.search(key):
                 sanitized[key] = "[REDACTED]"
             else:
                 sanitized[key] = value
@@ -222,31 +274,30 @@ _http_logger = SimpleHTTPLogger("OutgoingHTTP")
 # Store original methods for restoration
 _original_request = None
 
+# Correlates request and response log entries within this process
+_REQ_COUNTER = itertools.count()
+
 
 async def _logged_request(self, method: str, url, **kwargs):
     """Wrapper around ClientSession._request with logging."""
-    request_id = f"req_{uuid.uuid4().hex[:8]}"
-    start_time = time.time()
+    request_id = f"req_{next(_REQ_COUNTER):08x}"
+    start_time = time.perf_counter_ns()
     
     try:
-        # Extract request details for logging
-        headers = kwargs.get('headers', {})
-        if headers and hasattr(headers, 'items'):
-            headers_dict = dict(headers.items())
-        else:
-            headers_dict = dict(headers) if headers else {}
+        # Extract request details for logging; mappings are read in place,
+        # only a sequence of (name, value) pairs needs converting
+        headers = kwargs.get('headers') or {}
+        if not hasattr(headers, 'items'):
+            headers = dict(headers)
             
         # Get request body
         body = kwargs.get('data') or kwargs.get('json')
         
-        # Check if this is an OAuth request
-        is_oauth = _http_logger._is_oauth_request(str(url), headers_dict, body)
-        
-        # Log the request
-        _http_logger.log_request(
+        # Log the request; this also tells whether it is an OAuth request
+        is_oauth = _http_logger.log_request(
             method=method.upper(),
             url=str(url),
-            headers=headers_dict,
+            headers=headers,
             body=body,
             request_id=request_id
         )
@@ -255,11 +306,10 @@ async def _logged_request(self, method: str, url, **kwargs):
         response = await _original_request(self, method, url, **kwargs)
         
         # Calculate response time
-        end_time = time.time()
-        response_time_ms = (end_time - start_time) * 1000
+        response_time_ms = (time.perf_counter_ns() - start_time) / 1e6
         
         # Get response headers
-        response_headers = dict(response.headers.items()) if response.headers else {}
+        response_headers = response.headers or {}
         
         # For OAuth requests, try to capture response body safely
         response_body = "[Response body not captured to prevent consumption issues]"
@@ -286,8 +336,7 @@ async def _logged_request(self, method: str, url, **kwargs):
         
     except Exception as e:
         # Log error
-        end_time = time.time()
-        response_time_ms = (end_time - start_time) * 1000
+        response_time_ms = (time.perf_counter_ns() - start_time) / 1e6
         
         _http_logger.log_error(
             request_id=request_id,
@@ -320,14 +369,14 @@ def _patch_requests_library():
         
         def logged_requests_send(self, request, **kwargs):
             """Logged version of requests HTTPAdapter.send."""
-            request_id = f"req_{uuid.uuid4().hex[:8]}"
-            start_time = time.time()
+            request_id = f"req_{next(_REQ_COUNTER):08x}"
+            start_time = time.perf_counter_ns()
             
-            # Log request
-            _http_logger.log_request(
+            # Log request; this also tells whether it is an OAuth request
+            is_oauth = _http_logger.log_request(
                 method=request.method,
                 url=request.url,
-                headers=dict(request.headers) if request.headers else {},
+                headers=request.headers or {},
                 body=request.body,
                 request_id=request_id
             )
@@ -337,24 +386,22 @@ def _patch_requests_library():
                 response = _original_requests_request(self, request, **kwargs)
                 
                 # Log response
-                end_time = time.time()
-                response_time_ms = (end_time - start_time) * 1000
+                response_time_ms = (time.perf_counter_ns() - start_time) / 1e6
                 
                 _http_logger.log_response(
                     status=response.status_code,
-                    headers=dict(response.headers) if response.headers else {},
+                    headers=response.headers or {},
                     body=None,  # Don't capture response body to avoid consumption issues
                     request_id=request_id,
                     response_time_ms=response_time_ms,
-                    is_oauth_response=_http_logger.is_oauth_request(request.url, dict(request.headers) if request.headers else {}, request.body)
+                    is_oauth_response=is_oauth
                 )
                 
                 return response
                 
             except Exception as e:
                 # Log error
-                end_time = time.time()
-                response_time_ms = (end_time - start_time) * 1000
+                response_time_ms = (time.perf_counter_ns() - start_time) / 1e6
                 
                 _http_logger.log_error(
                     request_id=request_id,
@@ -386,18 +433,18 @@ def _patch_urllib3_library():
         
         def logged_urllib3_urlopen(self, method, url, **kwargs):
             """Logged version of urllib3 PoolManager.urlopen."""
-            request_id = f"req_{uuid.uuid4().hex[:8]}"
-            start_time = time.time()
+            request_id = f"req_{next(_REQ_COUNTER):08x}"
+            start_time = time.perf_counter_ns()
             
             # Extract headers and body from kwargs
-            headers = kwargs.get('headers', {})
+            headers = kwargs.get('headers') or {}
             body = kwargs.get('body')
             
-            # Log request
-            _http_logger.log_request(
+            # Log request; this also tells whether it is an OAuth request
+            is_oauth = _http_logger.log_request(
                 method=method,
                 url=url,
-                headers=dict(headers) if headers else {},
+                headers=headers,
                 body=body,
                 request_id=request_id
             )
@@ -407,24 +454,22 @@ def _patch_urllib3_library():
                 response = _original_urllib3_urlopen(self, method, url, **kwargs)
                 
                 # Log response
-                end_time = time.time()
-                response_time_ms = (end_time - start_time) * 1000
+                response_time_ms = (time.perf_counter_ns() - start_time) / 1e6
                 
                 _http_logger.log_response(
                     status=response.status,
-                    headers=dict(response.headers) if hasattr(response, 'headers') else {},
+                    headers=getattr(response, 'headers', None) or {},
                     body=None,  # Don't capture response body to avoid consumption issues
                     request_id=request_id,
                     response_time_ms=response_time_ms,
-                    is_oauth_response=_http_logger.is_oauth_request(url, headers or {}, body)
+                    is_oauth_response=is_oauth
                 )
                 
                 return response
                 
             except Exception as e:
                 # Log error
-                end_time = time.time()
-                response_time_ms = (end_time - start_time) * 1000
+                response_time_ms = (time.perf_counter_ns() - start_time) / 1e6
                 
                 _http_logger.log_error(
                     request_id=request_id,
@@ -469,6 +514,10 @@ def enable_http_logging():
     if _original_request is not None:
         # Already patched
         return
+
+    # Nothing would be logged, so leave the HTTP libraries untouched
+    if not _http_logger.logger.isEnabledFor(logging.INFO):
+        return
     
     # Patch aiohttp (async HTTP client)
     _original_request = ClientSession._request